@@ -67,8 +67,9 @@ if __name__ == "__main__":
     example_source_video_path = '../MP4/Source'
     example_hallo_video_path = '../MP4/Hallo'
 
-    example_source_video = cv2.VideoCapture(example_source_video_path + "/" + example_video_name)
-    example_hallo_video = cv2.VideoCapture(example_hallo_video_path + "/" + example_video_name)
+    # 视频由niqe.read_frames用PyAV解码
+    example_source_video = example_source_video_path + "/" + example_video_name
+    example_hallo_video = example_hallo_video_path + "/" + example_video_name
 
     example_FID_source_img_path = '../ImgsForFIDCalcu/source'
     example_FID_hallo_img_path = '../ImgsForFIDCalcu/hallo'
@@ -81,36 +82,24 @@ if __name__ == "__main__":
     PSNR = 0.0
     SSIM = 0.0
 
-    if example_source_video.isOpened() and example_hallo_video.isOpened():
-        rval_source, frame_source = example_source_video.read()  # 读取视频帧
-        rval_hallo, frame_hallo = example_hallo_video.read()
-    else:
-        rval_source = False
-        rval_hallo = False
-
-    while rval_source and rval_hallo:
-        # 对视频的每一帧进行处理
-        rval_source, frame_source = example_source_video.read()
+    # 对视频的每一帧进行处理
+    for frame_source, frame_hallo in zip(niqe.read_frames(example_source_video), niqe.read_frames(example_hallo_video)):
         img_source = niqe.img_scissors(frame_source, 720, 512)  # 对源视频的帧图像进行尺寸统一处理
-        rval_hallo, frame_hallo = example_hallo_video.read()
         img_hallo = frame_hallo
-        if img_source is None or img_hallo is None:
-            print("Loop End.")
-            break
-        else:
-            cv2.imwrite(example_FID_source_img_path + "/" + str(index) + ".jpg", img_source)
-            cv2.imwrite(example_FID_hallo_img_path + "/" + str(index) + ".jpg", img_hallo)
-            
-            #计算source与hallo的NIQE值
-            niqe_source += niqe.calculate_niqe(img_source, crop_border=0, params_path=params_path)
-            niqe_hallo += niqe.calculate_niqe(img_hallo, crop_border=0, params_path=params_path)
-            #计算PSNR值
-            PSNR += psnr_ssim.calculate_psnr(img_source, img_hallo, crop_border=0)
-            #计算SSIM值
-            SSIM += psnr_ssim.calculate_ssim(img_source, img_hallo, crop_border=0)
-            
-            print(index)
-            index += 1
+        cv2.imwrite(example_FID_source_img_path + "/" + str(index) + ".jpg", img_source)
+        cv2.imwrite(example_FID_hallo_img_path + "/" + str(index) + ".jpg", img_hallo)
+        
+        #计算source与hallo的NIQE值
+        niqe_source += niqe.calculate_niqe(img_source, crop_border=0, params_path=params_path)
+        niqe_hallo += niqe.calculate_niqe(img_hallo, crop_border=0, params_path=params_path)
+        #计算PSNR值
+        PSNR += psnr_ssim.calculate_psnr(img_source, img_hallo, crop_border=0)
+        #计算SSIM值
+        SSIM += psnr_ssim.calculate_ssim(img_source, img_hallo, crop_border=0)
+        
+        print(index)
+        index += 1
+    print("Loop End.")
     
     niqe_source /= index
     niqe_hallo /= index
@@ -1,12 +1,118 @@
+import av
 import cv2
 import math
+import multiprocessing
 import numpy as np
 import os
-from scipy.ndimage import convolve
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from numba import njit, prange, set_num_threads
 from scipy.special import gamma
 
 from utils import reorder_image, to_y_channel,imresize
 
+# The AGGD shape search table only depends on the candidate alphas, so it is
+# computed once at import instead of on every call of estimate_aggd_param.
+_GAM = np.arange(0.2, 10.001, 0.001)  # len = 9801
+_GAM_RECIPROCAL = np.reciprocal(_GAM)
+_R_GAM = np.square(gamma(_GAM_RECIPROCAL * 2)) / (gamma(_GAM_RECIPROCAL) * gamma(_GAM_RECIPROCAL * 3))
+_GAMMA_1_OVER_GAM = gamma(_GAM_RECIPROCAL)
+_GAMMA_2_OVER_GAM = gamma(_GAM_RECIPROCAL * 2)
+_GAMMA_3_OVER_GAM = gamma(_GAM_RECIPROCAL * 3)
+# r_gam is strictly increasing in alpha, so the closest entry can be found by
+# binary search instead of scanning the whole table. Bisecting on the closed
+# form of r_gam instead would drop the table, but each fit would then need
+# about 60 gamma evaluations (~40x slower than the 14 table reads), and alpha
+# would no longer be on the 0.001 grid of the official implementation.
+assert np.all(np.diff(_R_GAM) > 0), 'The AGGD lookup table must be monotonically increasing.'
+# Once the index is found, a fit reads alpha and the gamma ratios at this
+# index. They are packed in one row, so that the lookup touches a single
+# cache line instead of one per table, and the ratios are precomputed so that
+# a fit does no sqrt or division on them. Columns: alpha, the scale factor
+# sqrt(gamma(1/alpha) / gamma(3/alpha)) of beta_l and beta_r, and the factor
+# gamma(2/alpha) / gamma(1/alpha) of the mean in Eq. 8.
+_AGGD_TABLE = np.ascontiguousarray(
+    np.stack([_GAM, np.sqrt(_GAMMA_1_OVER_GAM / _GAMMA_3_OVER_GAM), _GAMMA_2_OVER_GAM / _GAMMA_1_OVER_GAM], axis=1))
+
+
+# NaN and inf are left enabled: a block without negative or positive
+# coefficients legitimately produces NaN, just like np.mean of an empty array.
+_FASTMATH = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+
+@njit(cache=True, fastmath=_FASTMATH, error_model='numpy')
+def _aggd_fit(l2_neg, cnt_neg, l2_pos, cnt_pos, sabs, ssq, n, r_gam):
+    """Fit the AGGD shape from the accumulated moments of a block.
+    The closest entry of the monotonically increasing ``r_gam`` table is
+    located by binary search. It matches ``np.argmin((r_gam - rhatnorm)**2)``,
+    including the tie-breaking towards the smaller index and returning 0 for
+    NaN.
+    Returns:
+        tuple: index into the AGGD tables (int), left_std (float) and
+            right_std (float).
+    """
+    left_std = np.sqrt(l2_neg / cnt_neg)
+    right_std = np.sqrt(l2_pos / cnt_pos)
+    gammahat = left_std / right_std
+    rhat = (sabs / n)**2 / (ssq / n)
+    rhatnorm = (rhat * (gammahat**3 + 1) * (gammahat + 1)) / ((gammahat**2 + 1)**2)
+
+    num = r_gam.size
+    if np.isnan(rhatnorm):
+        return 0, left_std, right_std
+    # branchless lower bound: the loop always runs ceil(log2(num)) = 14 times
+    # and the comparison compiles to a conditional move, not a jump
+    base = 0
+    length = num
+    while length > 1:
+        half = length // 2
+        base = base + half if r_gam[base + half] < rhatnorm else base
+        length -= half
+    idx = base + 1 if r_gam[base] < rhatnorm else base
+    if idx == num:
+        idx = num - 1
+    elif idx > 0 and (r_gam[idx - 1] - rhatnorm)**2 <= (r_gam[idx] - rhatnorm)**2:
+        idx = idx - 1
+    return idx, left_std, right_std
+
+
+@njit(cache=True, fastmath=_FASTMATH, error_model='numpy')
+def _aggd_core(block_flat, r_gam, table):
+    """Numba kernel of estimate_aggd_param.
+    The sums needed for the AGGD moments are accumulated in a single pass over
+    the block, without the boolean masks and copies of the numpy version.
+    Args:
+        block_flat (ndarray): Flattened image block.
+        r_gam (ndarray): The ``_R_GAM`` table.
+        table (ndarray): The ``_AGGD_TABLE`` table.
+    Returns:
+        tuple: alpha (float), beta_l (float) and beta_r (float).
+    """
+    l2_neg = 0.0
+    cnt_neg = 0
+    l2_pos = 0.0
+    cnt_pos = 0
+    sabs = 0.0
+    ssq = 0.0
+    for i in range(block_flat.size):
+        x = float(block_flat[i])
+        x2 = x * x
+        if x < 0:
+            l2_neg += x2
+            cnt_neg += 1
+        elif x > 0:
+            l2_pos += x2
+            cnt_pos += 1
+        sabs += abs(x)
+        ssq += x2
+
+    idx, left_std, right_std = _aggd_fit(l2_neg, cnt_neg, l2_pos, cnt_pos, sabs, ssq, block_flat.size, r_gam)
+    return table[idx, 0], left_std * table[idx, 1], right_std * table[idx, 1]
+
+
 def estimate_aggd_param(block):
     """Estimate AGGD (Asymmetric Generalized Gaussian Distribution) parameters.
     Args:
@@ -15,22 +121,130 @@ def estimate_aggd_param(block):
         tuple: alpha (float), beta_l (float) and beta_r (float) for the AGGD
             distribution (Estimating the parames in Equation 7 in the paper).
     """
-    block = block.flatten()
-    gam = np.arange(0.2, 10.001, 0.001)  # len = 9801
-    gam_reciprocal = np.reciprocal(gam)
-    r_gam = np.square(gamma(gam_reciprocal * 2)) / (gamma(gam_reciprocal) * gamma(gam_reciprocal * 3))
+    return _aggd_core(block.ravel(), _R_GAM, _AGGD_TABLE)
 
-    left_std = np.sqrt(np.mean(block[block < 0]**2))
-    right_std = np.sqrt(np.mean(block[block > 0]**2))
-    gammahat = left_std / right_std
-    rhat = (np.mean(np.abs(block)))**2 / np.mean(block**2)
-    rhatnorm = (rhat * (gammahat**3 + 1) * (gammahat + 1)) / ((gammahat**2 + 1)**2)
-    array_position = np.argmin((r_gam - rhatnorm)**2)
 
-    alpha = gam[array_position]
-    beta_l = left_std * np.sqrt(gamma(1 / alpha) / gamma(3 / alpha))
-    beta_r = right_std * np.sqrt(gamma(1 / alpha) / gamma(3 / alpha))
-    return (alpha, beta_l, beta_r)
+@njit(fastmath=_FASTMATH)
+def _accumulate(moments, v):
+    """Add a coefficient to the moments (l2_neg, cnt_neg, l2_pos, cnt_pos,
+    sabs, ssq) of a block.
+    The moments are kept in a tuple rather than an array, so that the
+    compiler holds them in registers and can unroll the reductions.
+    """
+    v2 = v * v
+    neg = v < 0
+    pos = v > 0
+    return (moments[0] + (v2 if neg else 0.0), moments[1] + (1.0 if neg else 0.0),
+            moments[2] + (v2 if pos else 0.0), moments[3] + (1.0 if pos else 0.0), moments[4] + abs(v),
+            moments[5] + v2)
+
+
+@njit(fastmath=_FASTMATH)
+def _accumulate_pixel(moments, x, x_left, x_up, x_up_left, x_up_right):
+    """Add a pixel and its products with its neighbours to the moments of
+    the block and of its 4 shifted products."""
+    x = float(x)
+    return (
+        _accumulate(moments[0], x),
+        _accumulate(moments[1], x * x_left),  # shift [0, 1]
+        _accumulate(moments[2], x * x_up),  # shift [1, 0]
+        _accumulate(moments[3], x * x_up_left),  # shift [1, 1]
+        _accumulate(moments[4], x * x_up_right),  # shift [1, -1]
+    )
+
+
+@njit(cache=True, fastmath=_FASTMATH, error_model='numpy', parallel=True)
+def _block_features(img, block_size_h, block_size_w, num_block_h, num_block_w, scale, r_gam, table):
+    """Numba kernel computing the features of all blocks of an image.
+    For every block, the moments of the coefficients and of their products
+    with the neighbour along the four shifts of compute_feature are gathered
+    in a single pass. The neighbours wrap around inside the block, exactly as
+    ``np.roll`` on the block does, so no shifted copy is ever materialized.
+    The block ``idx`` spans ``[idx * block_size // scale, (idx + 1) *
+    block_size // scale)``, so with an odd block size the downscaled blocks
+    alternate between two sizes.
+    Returns:
+        ndarray: Features with shape (num_block_w * num_block_h, 18), ordered
+            block column by block column.
+        ndarray: Whether each block has a NaN feature.
+    """
+    zero = (0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+    feat = np.empty((num_block_w * num_block_h, 18))
+    has_nan = np.empty(num_block_w * num_block_h, dtype=np.bool_)
+    # one parallel iteration per block, so that all the cores are busy even
+    # when the image is only a few blocks high
+    for b in prange(num_block_w * num_block_h):
+        idx_w = b // num_block_h
+        idx_h = b % num_block_h
+        top = idx_h * block_size_h // scale
+        left = idx_w * block_size_w // scale
+        height = (idx_h + 1) * block_size_h // scale - top
+        width = (idx_w + 1) * block_size_w // scale - left
+        n = height * width
+        last = width - 1
+        # moments of the block and of its 4 shifted products
+        moments = (zero, zero, zero, zero, zero)
+        for i in range(height):
+            row = img[top + i, left:left + width]
+            row_up = img[top + (i - 1 if i > 0 else height - 1), left:left + width]
+            # only the first and the last columns wrap around, the inner
+            # ones read their neighbours directly
+            moments = _accumulate_pixel(moments, row[0], row[last], row_up[0], row_up[last], row_up[1 % width])
+            for j in range(1, last):
+                moments = _accumulate_pixel(moments, row[j], row[j - 1], row_up[j], row_up[j - 1], row_up[j + 1])
+            if last > 0:
+                moments = _accumulate_pixel(
+                    moments, row[last], row[last - 1], row_up[last], row_up[last - 1], row_up[0])
+
+        for k in range(5):
+            l2_neg, cnt_neg, l2_pos, cnt_pos, sabs, ssq = moments[k]
+            idx, left_std, right_std = _aggd_fit(l2_neg, cnt_neg, l2_pos, cnt_pos, sabs, ssq, n, r_gam)
+            beta_l = left_std * table[idx, 1]
+            beta_r = right_std * table[idx, 1]
+            if k == 0:
+                feat[b, 0] = table[idx, 0]
+                feat[b, 1] = (beta_l + beta_r) / 2
+            else:
+                # Eq. 8
+                feat[b, 4 * k - 2] = table[idx, 0]
+                feat[b, 4 * k - 1] = (beta_r - beta_l) * table[idx, 2]
+                feat[b, 4 * k] = beta_l
+                feat[b, 4 * k + 1] = beta_r
+
+        # NaN only appears when a block has no negative or no positive
+        # coefficient, so this is almost always False
+        block_has_nan = False
+        for q in range(18):
+            block_has_nan = block_has_nan or np.isnan(feat[b, q])
+        has_nan[b] = block_has_nan
+    return feat, has_nan
+
+
+def compute_block_features(img, block_size_h, block_size_w, num_block_h=None, num_block_w=None, scale=1):
+    """Compute the features of every non-overlapping block of an image.
+    Args:
+        img (ndarray): 2D normalized image.
+        block_size_h (int): Height of the blocks at scale 1.
+        block_size_w (int): Width of the blocks at scale 1.
+        num_block_h (int | None): Number of blocks along the height. If None,
+            as many blocks as fit in the image at scale 1. Default: None.
+        num_block_w (int | None): Number of blocks along the width. If None,
+            as many blocks as fit in the image at scale 1. Default: None.
+        scale (int): Downscaling factor of the image. The block ``idx`` spans
+            ``[idx * block_size // scale, (idx + 1) * block_size // scale)``
+            along each axis. Default: 1.
+    Returns:
+        ndarray: Features with shape (num_blocks, 18), in the same order as
+            iterating the blocks column by column with compute_feature.
+        ndarray: Whether each block has a NaN feature, with shape
+            (num_blocks, ).
+    """
+    if num_block_h is None:
+        num_block_h = img.shape[0] // block_size_h
+    if num_block_w is None:
+        num_block_w = img.shape[1] // block_size_w
+    return _block_features(
+        np.ascontiguousarray(img), block_size_h, block_size_w, num_block_h, num_block_w, scale, _R_GAM, _AGGD_TABLE)
 
 
 def compute_feature(block):
@@ -40,25 +254,70 @@ def compute_feature(block):
     Returns:
         list: Features with length of 18.
     """
-    feat = []
-    alpha, beta_l, beta_r = estimate_aggd_param(block)
-    feat.extend([alpha, (beta_l + beta_r) / 2])
-
     # distortions disturb the fairly regular structure of natural images.
     # This deviation can be captured by analyzing the sample distribution of
     # the products of pairs of adjacent coefficients computed along
     # horizontal, vertical and diagonal orientations.
-    shifts = [[0, 1], [1, 0], [1, 1], [1, -1]]
-    for i in range(len(shifts)):
-        shifted_block = np.roll(block, shifts[i], axis=(0, 1))
-        alpha, beta_l, beta_r = estimate_aggd_param(block * shifted_block)
-        # Eq. 8
-        mean = (beta_r - beta_l) * (gamma(2 / alpha) / gamma(1 / alpha))
-        feat.extend([alpha, mean, beta_l, beta_r])
-    return feat
+    feat, _ = compute_block_features(block, *block.shape)
+    return feat[0].tolist()
+
+
+def separable_window(window):
+    """Split a 2D window into two 1D kernels if it is separable.
+    A Gaussian window is the outer product of two 1D Gaussians (rank 1), so
+    smoothing with it can be done as two 1D convolutions, which needs 2k
+    instead of k*k multiplies per pixel for a k x k window.
+    Args:
+        window (ndarray): 2D window.
+    Returns:
+        tuple | None: The 1D kernels along the height and the width, or None
+            if the window is not separable.
+    """
+    u, s, vt = np.linalg.svd(window)
+    if s.size > 1 and s[1] > s[0] * 1e-10:
+        return None
+    return u[:, 0] * np.sqrt(s[0]), vt[0] * np.sqrt(s[0])
+
+
+@njit(cache=True, parallel=True)
+def _normalize(img, mu, mu_sq):
+    """Numba kernel of Eq. 1 in the paper, fused into a single pass.
+    Args:
+        img (ndarray): 2D image.
+        mu (ndarray): Local mean of the image.
+        mu_sq (ndarray): Local mean of the squared image.
+    Returns:
+        ndarray: ``(img - mu) / (sigma + 1)``, with ``sigma`` the local
+            standard deviation ``sqrt(|mu_sq - mu^2|)``.
+    """
+    img_normalized = np.empty(img.shape)
+    for i in prange(img.shape[0]):
+        for j in range(img.shape[1]):
+            sigma = np.sqrt(abs(mu_sq[i, j] - mu[i, j] * mu[i, j]))
+            img_normalized[i, j] = (img[i, j] - mu[i, j]) / (sigma + 1)
+    return img_normalized
+
+
+def _smooth(img, window, kernels):
+    """Convolve an image with a window, replicating the border pixels.
+    It uses the vectorized filters of OpenCV, with the 1D kernels if the
+    window is separable. The filtering is done in float64 and rounded to the
+    input type once: sigma comes from E[x^2] - mu^2, which float32
+    accumulation visibly disturbs.
+    """
+    # OpenCV filters compute a correlation, so the kernels are flipped
+    if kernels is None:
+        smoothed = cv2.filter2D(
+            img.astype(np.float64), cv2.CV_64F, window[::-1, ::-1], borderType=cv2.BORDER_REPLICATE)
+    else:
+        kernel_h, kernel_w = kernels
+        # the separable filter widens the rows to float64 itself, so the image
+        # is not copied to float64 beforehand
+        smoothed = cv2.sepFilter2D(img, cv2.CV_64F, kernel_w[::-1], kernel_h[::-1], borderType=cv2.BORDER_REPLICATE)
+    return smoothed.astype(img.dtype)
 
 
-def niqe(img, mu_pris_param, cov_pris_param, gaussian_window, block_size_h=96, block_size_w=96):
+def niqe(img, mu_pris_param, cov_pris_param, gaussian_window, block_size_h=96, block_size_w=96, gaussian_kernels=None):
     """Calculate NIQE (Natural Image Quality Evaluator) metric.
     ``Paper: Making a "Completely Blind" Image Quality Analyzer``
     This implementation could produce almost the same results as the official
@@ -82,6 +341,9 @@ def niqe(img, mu_pris_param, cov_pris_param, gaussian_window, block_size_h=96, b
             Default: 96 (the official recommended value).
         block_size_w (int): Width of the blocks in to which image is divided.
             Default: 96 (the official recommended value).
+        gaussian_kernels (tuple | None): The 1D kernels of ``gaussian_window``
+            returned by ``separable_window``. If None, they are computed from
+            ``gaussian_window``. Default: None.
     """
     assert img.ndim == 2, ('Input image must be a gray or Y (of YCbCr) image with shape (h, w).')
     # crop image
@@ -90,45 +352,85 @@ def niqe(img, mu_pris_param, cov_pris_param, gaussian_window, block_size_h=96, b
     num_block_w = math.floor(w / block_size_w)
     img = img[0:num_block_h * block_size_h, 0:num_block_w * block_size_w]
 
+    if gaussian_kernels is None:
+        gaussian_kernels = separable_window(gaussian_window)
     distparam = []  # dist param is actually the multiscale features
+    has_nan = []
     for scale in (1, 2):  # perform on two scales (1, 2)
-        mu = convolve(img, gaussian_window, mode='nearest')
-        sigma = np.sqrt(np.abs(convolve(np.square(img), gaussian_window, mode='nearest') - np.square(mu)))
+        mu = _smooth(img, gaussian_window, gaussian_kernels)
+        mu_sq = _smooth(np.square(img), gaussian_window, gaussian_kernels)
         # normalize, as in Eq. 1 in the paper
-        img_nomalized = (img - mu) / (sigma + 1)
-
-        feat = []
-        for idx_w in range(num_block_w):
-            for idx_h in range(num_block_h):
-                # process ecah block
-                block = img_nomalized[idx_h * block_size_h // scale:(idx_h + 1) * block_size_h // scale,
-                                      idx_w * block_size_w // scale:(idx_w + 1) * block_size_w // scale]
-                feat.append(compute_feature(block))
+        img_nomalized = _normalize(img, mu, mu_sq)
 
-        distparam.append(np.array(feat))
+        # process all the blocks at once, the same blocks at both scales
+        feat, feat_has_nan = compute_block_features(
+            img_nomalized, block_size_h, block_size_w, num_block_h, num_block_w, scale=scale)
+        distparam.append(feat)
+        has_nan.append(feat_has_nan)
 
         if scale == 1:
+            # imresize is kept over cv2.resize to match MATLAB's bicubic
+            # antialiased imresize. Resizing in [0, 1] is kept as well: the
+            # float32 rounding it leads to noticeably affects sigma in flat
+            # regions, hence the scores.
             img = imresize(img / 255., scale=0.5, antialiasing=True)
-            img = img * 255.
+            img *= 255.
 
     distparam = np.concatenate(distparam, axis=1)
+    has_nan = np.any(has_nan, axis=0)
 
     # fit a MVG (multivariate Gaussian) model to distorted patch features
-    mu_distparam = np.nanmean(distparam, axis=0)
-    # use nancov. ref: https://ww2.mathworks.cn/help/stats/nancov.html
-    distparam_no_nan = distparam[~np.isnan(distparam).any(axis=1)]
+    # the blocks with NaN features are flagged by the kernel, so the features
+    # are only scanned for NaN when there are some
+    if has_nan.any():
+        mu_distparam = np.nanmean(distparam, axis=0)
+        # use nancov. ref: https://ww2.mathworks.cn/help/stats/nancov.html
+        distparam_no_nan = distparam[~has_nan]
+    else:
+        mu_distparam = np.mean(distparam, axis=0)
+        distparam_no_nan = distparam
     cov_distparam = np.cov(distparam_no_nan, rowvar=False)
 
     # compute niqe quality, Eq. 10 in the paper
-    invcov_param = np.linalg.pinv((cov_pris_param + cov_distparam) / 2)
-    quality = np.matmul(
-        np.matmul((mu_pris_param - mu_distparam), invcov_param), np.transpose((mu_pris_param - mu_distparam)))
+    # the covariance is symmetric, so its pseudo-inverse is applied through an
+    # eigendecomposition, which is cheaper than the SVD of np.linalg.pinv
+    cov_param = (cov_pris_param + cov_distparam) / 2
+    # eigh may return NaN where the SVD of np.linalg.pinv raised, e.g. when
+    # every block of a flat frame has NaN features, so raise the same error
+    if not np.isfinite(cov_param).all():
+        raise np.linalg.LinAlgError('SVD did not converge')
+    eigvals, eigvecs = np.linalg.eigh(cov_param)
+    # same cutoff of small singular values as np.linalg.pinv
+    cutoff = 1e-15 * np.abs(eigvals).max()
+    inv_eigvals = np.zeros_like(eigvals)
+    large = np.abs(eigvals) > cutoff
+    inv_eigvals[large] = 1 / eigvals[large]
+    proj = np.matmul(mu_pris_param - mu_distparam, eigvecs)
+    quality = np.sum(np.square(proj) * inv_eigvals)
 
     quality = np.sqrt(quality)
     quality = float(np.squeeze(quality))
     return quality
 
 
+@lru_cache(maxsize=4)
+def _load_params(params_path):
+    """Load the NIQE params estimated from the pristine dataset.
+    The params are cached, so the npz file is read once rather than for every
+    frame.
+    Args:
+        params_path (str): Folder of ``niqe_pris_params.npz``.
+    Returns:
+        tuple: mu_pris_param, cov_pris_param, gaussian_window and the 1D
+            kernels of gaussian_window (see ``separable_window``).
+    """
+    with np.load(os.path.join(params_path, 'niqe_pris_params.npz')) as niqe_pris_params:
+        mu_pris_param = niqe_pris_params['mu_pris_param']
+        cov_pris_param = niqe_pris_params['cov_pris_param']
+        gaussian_window = niqe_pris_params['gaussian_window']
+    return mu_pris_param, cov_pris_param, gaussian_window, separable_window(gaussian_window)
+
+
 def calculate_niqe(img, crop_border, params_path, input_order='HWC', convert_to='y', **kwargs):
     """Calculate NIQE (Natural Image Quality Evaluator) metric.
     ``Paper: Making a "Completely Blind" Image Quality Analyzer``
@@ -155,10 +457,7 @@ def calculate_niqe(img, crop_border, params_path, input_order='HWC', convert_to=
     """
     # ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
     # we use the official params estimated from the pristine dataset.
-    niqe_pris_params = np.load(os.path.join(params_path, 'niqe_pris_params.npz'))
-    mu_pris_param = niqe_pris_params['mu_pris_param']
-    cov_pris_param = niqe_pris_params['cov_pris_param']
-    gaussian_window = niqe_pris_params['gaussian_window']
+    mu_pris_param, cov_pris_param, gaussian_window, gaussian_kernels = _load_params(params_path)
 
     img = img.astype(np.float32)
     if input_order != 'HW':
@@ -175,7 +474,7 @@ def calculate_niqe(img, crop_border, params_path, input_order='HWC', convert_to=
     # round is necessary for being consistent with MATLAB's result
     img = img.round()
 
-    niqe_result = niqe(img, mu_pris_param, cov_pris_param, gaussian_window)
+    niqe_result = niqe(img, mu_pris_param, cov_pris_param, gaussian_window, gaussian_kernels=gaussian_kernels)
 
     return niqe_result
 
@@ -197,32 +496,121 @@ def img_scissors(img, origin_size, dest_size):  # 将img先裁剪为origin_size*
     resized_img_ubyte = img_as_ubyte(resized_img)
     return resized_img_ubyte
 
-def NIQE(video_origin, video_result):
+def read_frames(video):
+    """Iterate over the frames of a video.
+    Args:
+        video (str | cv2.VideoCapture): Path of the video, decoded with PyAV
+            straight from libavcodec, or an opened cv2.VideoCapture.
+    Yields:
+        ndarray: Frame with shape (h, w, 3), BGR order, uint8 type.
+    """
+    if isinstance(video, cv2.VideoCapture):
+        while video.isOpened():
+            rval, frame = video.read()
+            if not rval:
+                return
+            yield frame
+        return
+
+    with av.open(video) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = 'AUTO'  # let the decoder use several threads
+        for frame in container.decode(stream):
+            yield frame.to_ndarray(format='bgr24')
+
+
+def prefetch(frames, maxsize=4):
+    """Iterate over frames decoded ahead in a background thread.
+    Decoding mostly runs in C code that releases the GIL, so it overlaps with
+    the computation on the previous frames.
+    Args:
+        frames (iterable): Frames, e.g. from ``read_frames``.
+        maxsize (int): Maximum number of frames decoded ahead. Default: 4.
+    Yields:
+        The items of ``frames``.
+    """
+    frame_queue = queue.Queue(maxsize)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        # give up once the consumer is gone, instead of blocking forever
+        while not stop.is_set():
+            try:
+                frame_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def decode():
+        try:
+            for frame in frames:
+                if not put((frame, None)):
+                    return
+            put((end, None))
+        except Exception as error:
+            put((end, error))
+
+    thread = threading.Thread(target=decode, daemon=True)
+    thread.start()
+    try:
+        while True:
+            frame, error = frame_queue.get()
+            if error is not None:
+                raise error
+            if frame is end:
+                return
+            yield frame
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _init_niqe_worker(params_path):
+    """Initialize a process computing NIQE on frames.
+    The params are loaded once per process, and the Numba kernels run on a
+    single thread since the frames are already processed in parallel.
+    """
+    set_num_threads(1)
+    _load_params(params_path)
+
+
+def NIQE(video_origin, video_result, num_workers=None):
+    # the videos can be paths or opened cv2.VideoCapture, see read_frames
     params_path = 'pre-train-models/'
+    # frames are independent, so they are scored in parallel processes
+    num_workers = num_workers or os.cpu_count()
+    niqe_frame = partial(calculate_niqe, crop_border=0, params_path=params_path)
+    pending = deque()  # bounded, so that decoded frames do not pile up in memory
 
     index = 0
     niqe_origin = 0.0
     niqe_result = 0.0
     
-    if video_origin.isOpened() and video_result.isOpened():
-        rval_origin, frame_origin = video_origin.read()  # 读取视频帧
-        rval_result, frame_result = video_result.read()
-    else:
-        rval_origin = False
-        rval_result = False
-
-    while rval_origin and rval_result:
-        
-        rval_origin, frame_origin = video_origin.read()
-        img_origin = img_scissors(frame_origin, 720, 512)
-        rval_result, frame_result = video_result.read()
-        img_result = frame_result
-        if img_origin is None or img_result is None:
-            break
-        else:
-            niqe_origin += calculate_niqe(img_origin, crop_border=0, params_path=params_path)
-            niqe_result += calculate_niqe(img_result, crop_border=0, params_path=params_path)
+    # the workers are spawned, not forked: by the first submit this process
+    # runs the prefetch decoder threads and libavcodec's frame threads, and
+    # may run the threads of Numba's parallel kernels, none of which survive
+    # a fork
+    mp_context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(
+            num_workers, mp_context=mp_context, initializer=_init_niqe_worker,
+            initargs=(params_path, )) as executor:
+        # 读取视频帧
+        # stop at the end of the shorter video
+        # decode the next frames while the current ones are processed
+        for frame_origin, frame_result in zip(prefetch(read_frames(video_origin)), prefetch(read_frames(video_result))):
+            img_origin = img_scissors(frame_origin, 720, 512)
+            img_result = frame_result
+            pending.append((executor.submit(niqe_frame, img_origin), executor.submit(niqe_frame, img_result)))
             index += 1
+            if len(pending) > num_workers:
+                future_origin, future_result = pending.popleft()
+                niqe_origin += future_origin.result()
+                niqe_result += future_result.result()
+        for future_origin, future_result in pending:
+            niqe_origin += future_origin.result()
+            niqe_result += future_result.result()
     niqe_origin /= index
     niqe_result /= index
     return("The source video NIQE: " + str(niqe_origin) + "\nThe hallo genarated video NIQE: " + str(niqe_result))
@@ -235,29 +623,16 @@ if __name__ == '__main__':
     example_source_video_path = '../MP4/Source'
     example_hallo_video_path = '../MP4/Hallo'
     example_FID_source_img_path = '../JpgForQualitative/Macron'
-    example_source_video = cv2.VideoCapture(example_source_video_path + "/Macron.mp4")
-    example_hallo_video = cv2.VideoCapture(example_hallo_video_path + "/Macron.mp4")
+    example_source_video = example_source_video_path + "/Macron.mp4"
+    example_hallo_video = example_hallo_video_path + "/Macron.mp4"
     
-    if example_source_video.isOpened() and example_hallo_video.isOpened():
-        rval_source, frame_source = example_source_video.read()  # 读取视频帧
-        rval_hallo, frame_hallo = example_hallo_video.read()
-    else:
-        rval_source = False
-        rval_hallo = False
-
-    while rval_source and rval_hallo:
-        # 对视频的每一帧进行处理
-        rval_source, frame_source = example_source_video.read()
+    # 对视频的每一帧进行处理
+    for frame_source, frame_hallo in zip(read_frames(example_source_video), read_frames(example_hallo_video)):
         img_source = img_scissors(frame_source, 720, 512)  # 对源视频的帧图像进行尺寸统一处理
-        rval_hallo, frame_hallo = example_hallo_video.read()
         img_hallo = frame_hallo
-        if img_source is None or img_hallo is None:
-            print("Loop End.")
-            break
-        else:
-            if index % 100 == 0:
-                cv2.imwrite(example_FID_source_img_path + "/" + str(index) + ".jpg", img_source)
-                cv2.imwrite(example_FID_source_img_path + "/" + str(index) + "Res.jpg", img_hallo)
-            print(index)
-            index += 1
-    
+        if index % 100 == 0:
+            cv2.imwrite(example_FID_source_img_path + "/" + str(index) + ".jpg", img_source)
+            cv2.imwrite(example_FID_source_img_path + "/" + str(index) + "Res.jpg", img_hallo)
+        print(index)
+        index += 1
+    print("Loop End.")
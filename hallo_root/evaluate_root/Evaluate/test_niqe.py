@@ -0,0 +1,70 @@
+import math
+
+import numpy as np
+import pytest
+
+from niqe import _normalize, _smooth, compute_feature, niqe, separable_window
+from utils import imresize
+
+
+def _gaussian_window():
+    x = np.arange(7) - 3
+    window = np.exp(-(x[:, None]**2 + x[None]**2) / (2 * (7 / 6)**2))
+    return window / window.sum()
+
+
+def _niqe_reference(img, mu_pris_param, cov_pris_param, gaussian_window, block_size_h, block_size_w):
+    """NIQE with the per-block loop of the original implementation."""
+    h, w = img.shape
+    num_block_h = math.floor(h / block_size_h)
+    num_block_w = math.floor(w / block_size_w)
+    img = img[0:num_block_h * block_size_h, 0:num_block_w * block_size_w]
+
+    gaussian_kernels = separable_window(gaussian_window)
+    distparam = []
+    for scale in (1, 2):
+        mu = _smooth(img, gaussian_window, gaussian_kernels)
+        mu_sq = _smooth(np.square(img), gaussian_window, gaussian_kernels)
+        img_nomalized = _normalize(img, mu, mu_sq)
+
+        feat = []
+        for idx_w in range(num_block_w):
+            for idx_h in range(num_block_h):
+                block = img_nomalized[idx_h * block_size_h // scale:(idx_h + 1) * block_size_h // scale,
+                                      idx_w * block_size_w // scale:(idx_w + 1) * block_size_w // scale]
+                feat.append(compute_feature(block))
+        distparam.append(np.array(feat))
+
+        if scale == 1:
+            img = imresize(img / 255., scale=0.5, antialiasing=True)
+            img = img * 255.
+
+    distparam = np.concatenate(distparam, axis=1)
+    mu_distparam = np.nanmean(distparam, axis=0)
+    distparam_no_nan = distparam[~np.isnan(distparam).any(axis=1)]
+    cov_distparam = np.cov(distparam_no_nan, rowvar=False)
+
+    invcov_param = np.linalg.pinv((cov_pris_param + cov_distparam) / 2)
+    quality = np.matmul(np.matmul((mu_pris_param - mu_distparam), invcov_param), np.transpose((mu_pris_param - mu_distparam)))
+    return float(np.squeeze(np.sqrt(quality)))
+
+
+@pytest.mark.parametrize('block_size_h, block_size_w', [(96, 96), (95, 95), (33, 21), (21, 33)])
+def test_niqe_matches_per_block_loop(block_size_h, block_size_w):
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (300, 340)).astype(np.float32)
+    mu_pris_param = rng.normal(size=(1, 36))
+    cov = rng.normal(size=(36, 36))
+    cov_pris_param = cov @ cov.T / 36
+    gaussian_window = _gaussian_window()
+
+    result = niqe(img, mu_pris_param, cov_pris_param, gaussian_window, block_size_h, block_size_w)
+    expected = _niqe_reference(img, mu_pris_param, cov_pris_param, gaussian_window, block_size_h, block_size_w)
+    assert result == pytest.approx(expected, rel=1e-9)
+
+
+def test_niqe_raises_on_flat_image():
+    # every block of a flat image has NaN features, so the covariance is NaN
+    img = np.full((200, 200), 128, dtype=np.float32)
+    with pytest.raises(np.linalg.LinAlgError):
+        niqe(img, np.zeros((1, 36)), np.eye(36), _gaussian_window())